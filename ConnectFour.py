@@ -1,21 +1,30 @@
 # system libs
 import argparse
 import multiprocessing as mp
+import time as timer
 import tkinter as tk
 
 # 3rd party libs
 import numpy as np
 
 # Local libs
+from GameRecord import GameRecordWriter, RESULT_DRAW
 from Player import AIPlayer, RandomPlayer, HumanPlayer
 
+# How often the GUI checks on a running AI search, and waits between moves
+# when auto playing, in milliseconds
+POLL_INTERVAL = 50
+AUTO_PLAY_DELAY = 500
+
 #https://stackoverflow.com/a/37737985
-def turn_worker(board, send_end, p_func):
-    send_end.send(p_func(board))
+def turn_worker(board, send_end, player, p_func):
+    # Search progress is sent back while the search runs and the move last
+    player.progress = lambda *progress: send_end.send(('progress',) + progress)
+    send_end.send(('move', p_func(board)))
 
 
 class Game:
-    def __init__(self, player1, player2, time):
+    def __init__(self, player1, player2, time, record=None):
         self.players = [player1, player2]
         self.colors = ['yellow', 'red']
         self.current_turn = 0
@@ -23,10 +32,16 @@ class Game:
         self.gui_board = []
         self.game_over = False
         self.ai_turn_limit = time
+        self.record = record
+        self.moves = []
+        # (process, recv_end, start time) of the AI search that is running
+        self.search = None
+        self.auto_pending = False
 
         #https://stackoverflow.com/a/38159672
         root = tk.Tk()
         root.title('Connect 4')
+        self.root = root
         self.player_string = tk.Label(root, text=player1.player_string)
         self.player_string.pack()
         self.c = tk.Canvas(root, width=700, height=600)
@@ -38,13 +53,19 @@ class Game:
                 column.append(self.c.create_oval(row, col, row+100, col+100, fill=''))
             self.gui_board.append(column)
 
+        self.search_string = tk.Label(root, text='')
+        self.search_string.pack()
         tk.Button(root, text='Next Move', command=self.make_move).pack()
+        self.auto_play = tk.BooleanVar(value=False)
+        tk.Checkbutton(root, text='Auto Play', variable=self.auto_play,
+                       command=self.auto_move).pack()
 
         root.mainloop()
 
     def make_move(self):
-        if not self.game_over:
+        if not self.game_over and self.search is None:
             current_player = self.players[self.current_turn]
+            start = timer.perf_counter()
 
             if current_player.type == 'ai':
                 
@@ -52,33 +73,101 @@ class Game:
                     p_func = current_player.get_expectimax_move
                 else:
                     p_func = current_player.get_alpha_beta_move
-                
-                try:
-                    recv_end, send_end = mp.Pipe(False)
-                    p = mp.Process(target=turn_worker, args=(self.board, send_end, p_func))
-                    p.start()
-                    if p.join(self.ai_turn_limit) is None and p.is_alive():
-                        p.terminate()
-                        raise Exception('Player Exceeded time limit')
-                except Exception as e:
-                    uh_oh = 'Uh oh.... something is wrong with Player {}'
-                    print(uh_oh.format(current_player.player_number))
-                    print(e)
-                    raise Exception('Game Over')
-
-                move = recv_end.recv()
-            else:
-                move = current_player.get_move(self.board)
 
-            if move is not None:
-                self.update_board(int(move), current_player.player_number)
-
-            if self.game_completed(current_player.player_number):
-                self.game_over = True
-                self.player_string.configure(text=self.players[self.current_turn].player_string + ' wins!')
+                # The search runs in its own process and is polled from the
+                # Tk event loop, so the window stays responsive
+                recv_end, send_end = mp.Pipe(False)
+                p = mp.Process(target=turn_worker,
+                               args=(self.board, send_end, current_player, p_func),
+                               daemon=True)
+                p.start()
+                self.search = (p, recv_end, start)
+                self.search_string.configure(text='Player {} is thinking...'.format(
+                    current_player.player_number))
+                self.root.after(POLL_INTERVAL, self.poll_search)
             else:
-                self.current_turn = int(not self.current_turn)
-                self.player_string.configure(text=self.players[self.current_turn].player_string)
+                move = current_player.get_move(self.board)
+                self.finish_move(move, start)
+
+    def poll_search(self):
+        p, recv_end, start = self.search
+        current_player = self.players[self.current_turn]
+
+        try:
+            # Check before reading so nothing sent just before the process
+            # exited is missed
+            finished = not p.is_alive()
+            while recv_end.poll():
+                message = recv_end.recv()
+                if message[0] == 'move':
+                    p.join()
+                    self.search = None
+                    self.search_string.configure(text='')
+                    self.finish_move(message[1], start)
+                    return
+
+                ply, nodes, column, move = message[1:]
+                self.search_string.configure(
+                    text='depth {}/{}  nodes {}  searching column {}  best move {}'.format(
+                        ply, current_player.depth, nodes, column, move))
+
+            if finished:
+                raise Exception('Player stopped without making a move')
+            if timer.perf_counter() - start > self.ai_turn_limit:
+                p.terminate()
+                p.join()
+                raise Exception('Player Exceeded time limit')
+        except Exception as e:
+            self.search = None
+            self.game_over = True
+            # A player that fails to move forfeits the game
+            self.save_game(2 - self.current_turn)
+            uh_oh = 'Uh oh.... something is wrong with Player {}'
+            print(uh_oh.format(current_player.player_number))
+            print(e)
+            self.search_string.configure(text=str(e))
+            raise Exception('Game Over')
+
+        self.root.after(POLL_INTERVAL, self.poll_search)
+
+    def finish_move(self, move, start):
+        current_player = self.players[self.current_turn]
+
+        if move is not None:
+            self.update_board(int(move), current_player.player_number)
+            think_ms = (timer.perf_counter() - start) * 1000
+            self.moves.append((int(move), current_player.player_number, think_ms))
+
+        if self.game_completed(current_player.player_number):
+            self.game_over = True
+            self.save_game(current_player.player_number)
+            self.player_string.configure(text=self.players[self.current_turn].player_string + ' wins!')
+        elif 0 not in self.board[0]:
+            self.game_over = True
+            self.save_game(RESULT_DRAW)
+            self.player_string.configure(text='Draw!')
+        else:
+            self.current_turn = int(not self.current_turn)
+            self.player_string.configure(text=self.players[self.current_turn].player_string)
+            self.auto_move()
+
+    def auto_move(self):
+        # Humans still move with the Next Move button
+        if (self.auto_play.get() and not self.auto_pending and
+                self.players[self.current_turn].type != 'human'):
+            self.auto_pending = True
+            self.root.after(AUTO_PLAY_DELAY, self.auto_step)
+
+    def auto_step(self):
+        self.auto_pending = False
+        # The turn may have passed to a human since this was scheduled
+        if self.auto_play.get() and self.players[self.current_turn].type != 'human':
+            self.make_move()
+
+    def save_game(self, result):
+        if self.record is not None:
+            with GameRecordWriter(self.record) as writer:
+                writer.write_game(self.moves, result, [p.type for p in self.players])
 
     def update_board(self, move, player_num):
         if 0 in self.board[:,move]:
@@ -137,7 +226,7 @@ class Game:
 
 
 
-def main(player1, player2, time):
+def main(player1, player2, time, record=None):
     """
     Creates player objects based on the string paramters that are passed
     to it and calls play_game()
@@ -145,6 +234,7 @@ def main(player1, player2, time):
     INPUTS:
     player1 - a string ['ai', 'random', 'human']
     player2 - a string ['ai', 'random', 'human']
+    record - an optional path of a game record file the game is appended to
     """
     def make_player(name, num):
         if name=='ai':
@@ -154,7 +244,7 @@ def main(player1, player2, time):
         elif name=='human':
             return HumanPlayer(num)
 
-    Game(make_player(player1, 1), make_player(player2, 2), time)
+    Game(make_player(player1, 1), make_player(player2, 2), time, record)
 
 
 def play_game(player1, player2):
@@ -181,6 +271,9 @@ if __name__=='__main__':
                         type=int,
                         default=60,
                         help='Time to wait for a move in seconds (int)')
+    parser.add_argument('--record',
+                        default=None,
+                        help='Game record file to append the game to')
     args = parser.parse_args()
 
-    main(args.player1, args.player2, args.time)
\ No newline at end of file
+    main(args.player1, args.player2, args.time, args.record)
\ No newline at end of file
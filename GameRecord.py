@@ -0,0 +1,470 @@
+# system libs
+import heapq
+import mmap
+import numbers
+import os
+import struct
+import tempfile
+import zlib
+from array import array
+from collections import namedtuple
+
+
+# Every archive starts with an 8 byte header: magic + format version
+FILE_MAGIC = b'C4GR'
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct('<4sBxxx')
+
+# Each game is a small header followed by its moves
+#   result (0 draw, 1 or 2 for the winner), player1 type, player2 type,
+#   number of moves
+GAME_HEADER = struct.Struct('<BBBH')
+#   column, player number, think time in milliseconds
+MOVE = struct.Struct('<BBI')
+# The largest a game can be, a longer broken tail is not a cut off game
+MAX_GAME_SIZE = GAME_HEADER.size + 42 * MOVE.size
+
+# Position indexes are kept next to the archive in a sidecar file: a header
+#   magic, version, max ply (0 for every move), size of the archive that was
+#   indexed, number of games, number of entries, offset and crc32 of the last
+#   game so an archive rewritten to the same size is noticed
+# followed by the entries sorted by key, then one result byte per game
+INDEX_MAGIC = b'C4GI'
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct('<4sBBxxQQQQI')
+#   position key, game number << 8 | ply (ply 0 is the empty board)
+INDEX_ENTRY = struct.Struct('<QQ')
+INDEX_SUFFIX = '.idx'
+# Number of entries sorted in memory at once while an index is built
+INDEX_CHUNK = 1 << 20
+
+RESULT_DRAW = 0
+PLAYER_TYPES = ['ai', 'random', 'human']
+
+ROWS = 6
+COLUMNS = 7
+
+GameRecord = namedtuple('GameRecord', ['result', 'player_types', 'moves'])
+Move = namedtuple('Move', ['column', 'player', 'think_ms'])
+
+
+def position_key(board):
+    """
+    Given a board return an integer that uniquely identifies the position
+
+    Each column uses 7 bits; the bits of the pieces of player 1 are added to
+    a mask of every occupied square, which leaves the column height encoded
+    in the sum. This is the same key that replay() produces incrementally.
+
+    INPUTS:
+    board - a numpy array (or list of rows) containing the state of the
+            board using the same encoding as the Player classes:
+            - row 0 is the top of the board
+            - 0 is empty, 1 and 2 are the pieces of each player
+
+    RETURNS:
+    A non-negative integer below 2**49
+    """
+    player1 = 0
+    mask = 0
+    for col in range(COLUMNS):
+        for row in range(ROWS):
+            piece = board[ROWS - 1 - row][col]
+            if piece == 0:
+                break
+            bit = 1 << (col * (ROWS + 1) + row)
+            mask |= bit
+            if piece == 1:
+                player1 |= bit
+
+    return player1 + mask
+
+
+def replay(moves):
+    """
+    Play a sequence of moves on an empty board without building any board
+    arrays.
+
+    INPUTS:
+    moves - an iterable of Move tuples (or anything with column and player
+            as the first two items)
+
+    RETURNS:
+    A generator that yields the position_key() after each move
+    """
+    heights = [0] * COLUMNS
+    player1 = 0
+    mask = 0
+    for move in moves:
+        column, player = move[0], move[1]
+        if heights[column] >= ROWS:
+            raise Exception('Invalid move by player {}. Column {}'.format(player, column))
+
+        bit = 1 << (column * (ROWS + 1) + heights[column])
+        heights[column] += 1
+        mask |= bit
+        if player == 1:
+            player1 |= bit
+
+        yield player1 + mask
+
+
+def iter_game_offsets(data, size):
+    """
+    Walk the game headers of an archive, skipping over the moves
+
+    INPUTS:
+    data - the archive contents, e.g. a memory map of the file
+    size - the size of the archive in bytes
+
+    RETURNS:
+    A generator that yields the offset of every complete game. A game that
+    was only partly written is ignored.
+    """
+    offset = FILE_HEADER.size
+    while offset + GAME_HEADER.size <= size:
+        num_moves = GAME_HEADER.unpack_from(data, offset)[3]
+        end = offset + GAME_HEADER.size + num_moves * MOVE.size
+        if end > size:
+            break
+        yield offset
+        offset = end
+
+
+def last_game(data, size):
+    # Offset of the last complete game and the offset just past it
+    start, end = 0, FILE_HEADER.size
+    for offset in iter_game_offsets(data, size):
+        num_moves = GAME_HEADER.unpack_from(data, offset)[3]
+        start, end = offset, offset + GAME_HEADER.size + num_moves * MOVE.size
+    return start, end
+
+
+class GameRecordWriter:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+
+        # New archives get a header, existing ones must already have one
+        try:
+            size = self.file.tell()
+            if size == 0:
+                self.file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION))
+            else:
+                with open(path, 'rb') as f:
+                    check_header(f.read(FILE_HEADER.size), path)
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                        end = last_game(data, size)[1]
+
+                # Drop a game that was cut off part way through, otherwise
+                # the games written after it would be read as part of it.
+                # Anything longer than a game is left for the user to look at.
+                if size - end >= MAX_GAME_SIZE:
+                    err = '{} is damaged after byte {}, {} bytes can\'t be read'
+                    raise Exception(err.format(path, end, size - end))
+                if end < size:
+                    print('Removing {} bytes of a game cut off at the end of {}'.format(
+                        size - end, path))
+                    self.file.truncate(end)
+        except Exception:
+            self.file.close()
+            raise
+
+    def write_game(self, moves, result, player_types):
+        """
+        Append a finished game to the archive
+
+        INPUTS:
+        moves - a list of (column, player, think_ms) tuples in the order
+                they were played
+        result - RESULT_DRAW or the number of the winning player
+        player_types - a pair of strings from PLAYER_TYPES
+
+        RETURNS:
+        None
+        """
+        p1_type, p2_type = (PLAYER_TYPES.index(t) for t in player_types)
+        data = bytearray(GAME_HEADER.pack(result, p1_type, p2_type, len(moves)))
+        for column, player, think_ms in moves:
+            data += MOVE.pack(column, player, min(int(think_ms), 0xFFFFFFFF))
+
+        self.file.write(data)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GameRecordReader:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        try:
+            check_header(self.file.read(FILE_HEADER.size), path)
+        except Exception:
+            self.file.close()
+            raise
+
+        # The archive is memory mapped so only the games that are read get
+        # paged in, no matter how large the file is
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = None
+
+    def __iter__(self):
+        """
+        Stream every game in the archive in the order it was written
+        """
+        for offset in self.iter_offsets():
+            yield self.read_game(offset)
+
+    def __len__(self):
+        return len(self.get_offsets())
+
+    def __getitem__(self, i):
+        return self.read_game(self.get_offsets()[i])
+
+    def iter_offsets(self):
+        return iter_game_offsets(self.data, self.size)
+
+    def get_signature(self):
+        # Offset and crc32 of the last game, 0 and 0 for an empty archive
+        offsets = self.get_offsets()
+        if not offsets:
+            return 0, 0
+        start = offsets[-1]
+        num_moves = GAME_HEADER.unpack_from(self.data, start)[3]
+        end = start + GAME_HEADER.size + num_moves * MOVE.size
+        return start, zlib.crc32(self.data[start:end])
+
+    def get_offsets(self):
+        # Built on first use for random access, 8 bytes per game
+        if self.offsets is None:
+            self.offsets = array('Q', self.iter_offsets())
+        return self.offsets
+
+    def read_game(self, offset):
+        result, p1_type, p2_type, num_moves = GAME_HEADER.unpack_from(self.data, offset)
+        start = offset + GAME_HEADER.size
+        end = start + num_moves * MOVE.size
+        moves = [Move(*m) for m in MOVE.iter_unpack(self.data[start:end])]
+        return GameRecord(result, (PLAYER_TYPES[p1_type], PLAYER_TYPES[p2_type]), moves)
+
+    def build_index(self, max_ply=None, path=None):
+        """
+        Index every position reached in the archive and save the index in a
+        sidecar file
+
+        The entries are sorted in chunks of INDEX_CHUNK that are merged into
+        the sidecar, so building the index doesn't need memory for all of it
+
+        INPUTS:
+        max_ply - only index the first max_ply moves of each game, which
+                  keeps the index small when only openings are of interest
+        path - where to save the index, the archive path + INDEX_SUFFIX by
+               default
+
+        RETURNS:
+        A PositionIndex
+        """
+        if path is None:
+            path = self.path + INDEX_SUFFIX
+
+        results = bytearray()
+        chunks = []
+        entries = []
+        num_entries = 0
+        try:
+            for game_number, game in enumerate(self):
+                results.append(game.result)
+                moves = game.moves if max_ply is None else game.moves[:max_ply]
+                # Every game starts from the empty board, whose key is 0
+                entries.append(game_number << 8)
+                for ply, key in enumerate(replay(moves), 1):
+                    # key and occurrence packed into one int so the chunk sorts fast
+                    entries.append(key << 64 | game_number << 8 | ply)
+
+                if len(entries) >= INDEX_CHUNK:
+                    num_entries += len(entries)
+                    chunks.append(write_chunk(entries))
+                    entries = []
+            num_entries += len(entries)
+            chunks.append(write_chunk(entries))
+
+            with open(path, 'wb') as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, max_ply or 0,
+                                          self.size, len(results), num_entries,
+                                          *self.get_signature()))
+                for entry in heapq.merge(*(read_chunk(chunk) for chunk in chunks)):
+                    f.write(INDEX_ENTRY.pack(*entry))
+                f.write(results)
+        finally:
+            for chunk in chunks:
+                chunk.close()
+
+        return PositionIndex(path)
+
+    def get_index(self, max_ply=None, path=None):
+        """
+        Open the sidecar index of the archive, building it when it is
+        missing or the archive has changed since it was built
+
+        RETURNS:
+        A PositionIndex
+        """
+        if path is None:
+            path = self.path + INDEX_SUFFIX
+
+        if os.path.exists(path):
+            try:
+                index = PositionIndex(path)
+            except Exception:
+                # The index is only a cache of the archive, an old or broken
+                # one is built again
+                return self.build_index(max_ply, path)
+            if (index.archive_size == self.size and index.max_ply == (max_ply or 0) and
+                    index.signature == self.get_signature()):
+                return index
+            index.close()
+
+        return self.build_index(max_ply, path)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PositionIndex:
+    def __init__(self, path):
+        """
+        Open a sidecar index written by GameRecordReader.build_index()
+
+        The file is memory mapped and searched in place, so opening an index
+        costs the same no matter how many games it covers
+        """
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            header = self.file.read(INDEX_HEADER.size)
+            if len(header) < INDEX_HEADER.size:
+                raise Exception('{} is not a position index file'.format(path))
+
+            (magic, version, self.max_ply, self.archive_size, self.num_games,
+             self.num_entries, *self.signature) = INDEX_HEADER.unpack(header)
+            self.signature = tuple(self.signature)
+            if magic != INDEX_MAGIC:
+                raise Exception('{} is not a position index file'.format(path))
+            if version != INDEX_VERSION:
+                raise Exception('Unsupported position index version {} in {}'.format(version, path))
+
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+
+        self.results_offset = INDEX_HEADER.size + self.num_entries * INDEX_ENTRY.size
+
+    def __len__(self):
+        return self.num_entries
+
+    def get_key(self, i):
+        return INDEX_ENTRY.unpack_from(self.data, INDEX_HEADER.size + i * INDEX_ENTRY.size)[0]
+
+    def lookup(self, position):
+        """
+        Find every time a position was reached
+
+        INPUTS:
+        position - a board or a key from position_key()
+
+        RETURNS:
+        A list of (game number, ply) tuples, ply 0 being the empty board
+        """
+        if isinstance(position, numbers.Integral):
+            position = int(position)
+        else:
+            position = position_key(position)
+
+        # Binary search for the first entry with the key
+        low, high = 0, self.num_entries
+        while low < high:
+            mid = (low + high) // 2
+            if self.get_key(mid) < position:
+                low = mid + 1
+            else:
+                high = mid
+
+        occurrences = []
+        offset = INDEX_HEADER.size + low * INDEX_ENTRY.size
+        while offset < self.results_offset:
+            key, occurrence = INDEX_ENTRY.unpack_from(self.data, offset)
+            if key != position:
+                break
+            occurrences.append((occurrence >> 8, occurrence & 0xFF))
+            offset += INDEX_ENTRY.size
+        return occurrences
+
+    def get_results(self, position):
+        """
+        Count how the games that reached a position ended
+
+        RETURNS:
+        A dict mapping RESULT_DRAW, 1 and 2 to the number of games
+        """
+        counts = {RESULT_DRAW: 0, 1: 0, 2: 0}
+        for game, _ in self.lookup(position):
+            counts[self.data[self.results_offset + game]] += 1
+        return counts
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_chunk(entries):
+    # Sort a chunk of packed entries into a temporary file
+    entries.sort()
+    chunk = tempfile.TemporaryFile()
+    mask = (1 << 64) - 1
+    for entry in entries:
+        chunk.write(INDEX_ENTRY.pack(entry >> 64, entry & mask))
+    chunk.seek(0)
+    return chunk
+
+
+def read_chunk(chunk, entries_per_read=4096):
+    # Stream the (key, occurrence) entries of a sorted chunk back in order
+    while True:
+        data = chunk.read(entries_per_read * INDEX_ENTRY.size)
+        if not data:
+            return
+        yield from INDEX_ENTRY.iter_unpack(data)
+
+
+def check_header(header, path):
+    if len(header) < FILE_HEADER.size:
+        raise Exception('{} is not a game record file'.format(path))
+
+    magic, version = FILE_HEADER.unpack(header)
+    if magic != FILE_MAGIC:
+        raise Exception('{} is not a game record file'.format(path))
+    if version != FILE_VERSION:
+        raise Exception('Unsupported game record version {} in {}'.format(version, path))
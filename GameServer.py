@@ -0,0 +1,417 @@
+# system libs
+import argparse
+import asyncio
+import itertools
+import os
+import time as timer
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from GameRecord import GameRecordWriter, RESULT_DRAW, ROWS, COLUMNS
+from Player import AIPlayer, RandomPlayer
+
+
+# 'remote' players are the clients connected to the server
+PLAYER_TYPES = ['ai', 'random', 'remote']
+
+# remote players are stored as human players in game records
+RECORD_TYPES = {'ai': 'ai', 'random': 'random', 'remote': 'human'}
+
+# Seconds allowed past the deadline for a search to hand back its move
+SEARCH_GRACE = 1
+
+
+def ai_worker(board, player_number, opponent_type, depth, deadline):
+    """
+    Runs a single AI search in a worker process of the pool, picking the
+    search the same way Game does. The search stops at deadline (a
+    time.time()) so the worker is free again for the next game.
+
+    RETURNS:
+    The 0 based index of the column that represents the next move, or None
+    if the deadline passed before any move was searched
+    """
+    player = AIPlayer(player_number)
+    player.depth = depth
+    player.deadline = deadline
+    if opponent_type == 'random':
+        return player.get_expectimax_move(board)
+    return player.get_alpha_beta_move(board)
+
+
+def drop_piece(board, move, player_num):
+    """
+    Place a piece for player_num in the column move
+
+    RETURNS:
+    The row the piece landed in
+    """
+    if not 0 <= move < COLUMNS or board[0, move] != 0:
+        err = 'Invalid move by player {}. Column {}'.format(player_num, move)
+        raise Exception(err)
+
+    row = ROWS - 1
+    while board[row, move] != 0:
+        row -= 1
+    board[row, move] = player_num
+    return row
+
+
+def four_in_a_row(board, row, col, player_num):
+    # Only the lines through the last piece can have been completed
+    for d_row, d_col in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+        count = 1
+        for sign in [1, -1]:
+            r, c = row + sign * d_row, col + sign * d_col
+            while 0 <= r < ROWS and 0 <= c < COLUMNS and board[r, c] == player_num:
+                count += 1
+                r, c = r + sign * d_row, c + sign * d_col
+        if count >= 4:
+            return True
+    return False
+
+
+class ServerGame:
+    def __init__(self, game_id, player_types, connection):
+        self.id = game_id
+        self.player_types = player_types
+        self.connection = connection
+        self.board = np.zeros([ROWS, COLUMNS]).astype(np.uint8)
+        self.current_turn = 0
+        self.moves = []
+        self.game_over = False
+        self.turn_started = timer.perf_counter()
+        # Forfeits the game when a remote player takes too long
+        self.turn_timer = None
+
+    @property
+    def player_number(self):
+        return self.current_turn + 1
+
+
+class GameServer:
+    def __init__(self, workers, time, depth, remote_time, record=None):
+        self.workers = workers
+        self.ai_turn_limit = time
+        self.depth = depth
+        self.remote_turn_limit = remote_time
+        self.record = record
+        self.games = {}
+        self.tasks = set()
+        self.game_ids = itertools.count(1)
+        self.pool = None
+        self.slots = None
+        self.writer = None
+
+    async def serve(self, host, port):
+        """
+        Accept connections until cancelled. Every connection can host any
+        number of games at once.
+        """
+        self.pool = ProcessPoolExecutor(self.workers)
+        # Searches are only handed to the pool when a worker is free, so a
+        # burst of games queues here instead of inside the executor
+        self.slots = asyncio.Semaphore(self.workers)
+        if self.record is not None:
+            self.writer = GameRecordWriter(self.record)
+
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print('Serving on {}'.format(', '.join(str(s.getsockname()) for s in server.sockets)))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            if self.writer is not None:
+                self.writer.close()
+
+    async def handle_connection(self, reader, writer):
+        """
+        Line protocol, one command per line:
+            new <player1> <player2>   -> game <id>
+            move <id> <column>
+            resign <id>               the remote player gives up the game
+            quit
+        and the server sends:
+            move <id> <player> <column>
+            turn <id> <player>        when a remote player has to move
+            over <id> <result> [reason]  result is 0 for a draw or the
+                                         winner, reason is timeout, error,
+                                         invalid or resign when a player
+                                         forfeits
+            error <id or -> <message>
+        """
+        games = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                args = line.decode().split()
+                if not args:
+                    continue
+                if args[0] == 'quit':
+                    break
+                elif args[0] == 'new' and len(args) == 3 and all(a in PLAYER_TYPES for a in args[1:]):
+                    game = ServerGame(next(self.game_ids), args[1:], writer)
+                    self.games[game.id] = game
+                    games.append(game)
+                    await self.send(game, 'game', game.id)
+                    self.start(game)
+                elif args[0] == 'move' and len(args) == 3:
+                    await self.remote_move(writer, args[1], args[2])
+                elif args[0] == 'resign' and len(args) == 2:
+                    await self.resign(writer, args[1])
+                else:
+                    writer.write('error - invalid command {}\n'.format(' '.join(args)).encode())
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            # Abandoned games stop at their next turn
+            for game in games:
+                game.game_over = True
+                self.games.pop(game.id, None)
+                if game.turn_timer is not None:
+                    game.turn_timer.cancel()
+            writer.close()
+
+    def start(self, game):
+        self.spawn(self.advance(game))
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def get_game(self, writer, game_id):
+        # A game of this connection, or None after telling the client
+        game = self.games.get(int(game_id)) if game_id.isdigit() else None
+        if game is None or game.connection is not writer:
+            writer.write('error {} unknown game\n'.format(game_id).encode())
+            await writer.drain()
+            return None
+        return game
+
+    async def remote_move(self, writer, game_id, move):
+        game = await self.get_game(writer, game_id)
+        if game is None:
+            return
+        elif game.game_over or game.player_types[game.current_turn] != 'remote':
+            await self.send(game, 'error', game.id, 'not your turn')
+        else:
+            try:
+                think_ms = (timer.perf_counter() - game.turn_started) * 1000
+                await self.play(game, int(move), think_ms)
+            except Exception as e:
+                await self.send(game, 'error', game.id, e)
+                return
+            self.start(game)
+
+    async def resign(self, writer, game_id):
+        game = await self.get_game(writer, game_id)
+        if game is None or game.game_over:
+            return
+
+        # The remote player whose turn it is, or else the only one
+        if game.player_types[game.current_turn] == 'remote':
+            loser = game.current_turn
+        else:
+            loser = game.player_types.index('remote')
+        await self.finish(game, 2 - loser, 'resign')
+
+    def remote_timeout(self, game, ply):
+        # Called by the turn timer, unless the remote player moved meanwhile
+        if not game.game_over and len(game.moves) == ply:
+            self.spawn(self.forfeit(game, 'timeout', 'Remote player exceeded time limit'))
+
+    async def advance(self, game):
+        """
+        Make every server side move until a remote player has to move or the
+        game is over
+        """
+        while not game.game_over:
+            player_type = game.player_types[game.current_turn]
+            game.turn_started = timer.perf_counter()
+
+            if player_type == 'remote':
+                game.turn_timer = asyncio.get_running_loop().call_later(
+                    self.remote_turn_limit, self.remote_timeout, game, len(game.moves))
+                await self.send(game, 'turn', game.id, game.player_number)
+                return
+
+            try:
+                if player_type == 'random':
+                    move = RandomPlayer(game.player_number).get_move(game.board)
+                else:
+                    move = await self.search(game)
+                    if move is None:
+                        raise asyncio.TimeoutError()
+            except asyncio.TimeoutError:
+                await self.forfeit(game, 'timeout', 'Player Exceeded time limit')
+                return
+            except Exception as e:
+                # Errors raised in the search or by a broken pool
+                await self.forfeit(game, 'error', e)
+                return
+
+            # The game may have been resigned or abandoned during the search
+            if game.game_over:
+                return
+
+            think_ms = (timer.perf_counter() - game.turn_started) * 1000
+            try:
+                await self.play(game, int(move), think_ms)
+            except Exception as e:
+                await self.forfeit(game, 'invalid', e)
+
+    async def search(self, game):
+        """
+        Run the AI search for the current player in the process pool
+
+        The deadline covers the time spent waiting for a free worker. The
+        search itself stops at the deadline with its best move so far, so a
+        slow search doesn't keep its worker from the other games.
+
+        RETURNS:
+        The column to play, or None if no move was found in time
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        opponent_type = game.player_types[int(not game.current_turn)]
+
+        await asyncio.wait_for(self.slots.acquire(), self.ai_turn_limit)
+        remaining = max(self.ai_turn_limit - (loop.time() - start), 0)
+        try:
+            pool, future = self.submit(game.board.copy(), game.player_number, opponent_type,
+                                       self.depth, timer.time() + remaining)
+        except Exception:
+            self.slots.release()
+            raise
+
+        # The slot is given back when the worker is done, not when the server
+        # stops waiting for it
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.slots.release))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), remaining + SEARCH_GRACE)
+        except BrokenProcessPool:
+            self.reset_pool(pool)
+            raise
+
+    def submit(self, *args):
+        pool = self.pool
+        try:
+            return pool, pool.submit(ai_worker, *args)
+        except BrokenProcessPool:
+            self.reset_pool(pool)
+            return self.pool, self.pool.submit(ai_worker, *args)
+
+    def reset_pool(self, pool):
+        # A worker that dies (e.g. killed for using too much memory) breaks
+        # the whole pool, so it is replaced once for every game that saw it
+        if self.pool is pool:
+            print('Worker pool is broken, starting a new one')
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = ProcessPoolExecutor(self.workers)
+
+    async def play(self, game, move, think_ms):
+        player_num = game.player_number
+        row = drop_piece(game.board, move, player_num)
+        if game.turn_timer is not None:
+            game.turn_timer.cancel()
+            game.turn_timer = None
+        game.moves.append((move, player_num, think_ms))
+        await self.send(game, 'move', game.id, player_num, move)
+
+        if four_in_a_row(game.board, row, move, player_num):
+            await self.finish(game, player_num)
+        elif 0 not in game.board[0]:
+            await self.finish(game, RESULT_DRAW)
+        else:
+            game.current_turn = int(not game.current_turn)
+
+    async def forfeit(self, game, reason, e):
+        # The current player loses the game
+        print('Uh oh.... something is wrong with Player {} in game {}'.format(
+            game.player_number, game.id))
+        print(e)
+        await self.finish(game, 2 - game.current_turn, reason)
+
+    async def finish(self, game, result, reason=None):
+        game.game_over = True
+        if game.turn_timer is not None:
+            game.turn_timer.cancel()
+        self.games.pop(game.id, None)
+        if self.writer is not None:
+            self.writer.write_game(game.moves, result, [RECORD_TYPES[t] for t in game.player_types])
+
+        if reason is None:
+            await self.send(game, 'over', game.id, result)
+        else:
+            await self.send(game, 'over', game.id, result, reason)
+
+    async def send(self, game, *args):
+        writer = game.connection
+        if writer.is_closing():
+            game.game_over = True
+            return
+        writer.write((' '.join(str(a) for a in args) + '\n').encode())
+        try:
+            await writer.drain()
+        except ConnectionError:
+            # The connection handler cleans up the games of the connection
+            game.game_over = True
+
+
+def main(host, port, workers, time, depth, remote_time, record=None):
+    """
+    Starts a game server hosting games between AI, random and remote players
+
+    INPUTS:
+    host, port - the address to listen on
+    workers - the number of processes used for AI searches
+    time - time limit for an AI move in seconds
+    depth - search depth of the AI players
+    remote_time - time limit for a remote player's move in seconds
+    record - an optional path of a game record file finished games are
+             appended to
+    """
+    server = GameServer(workers, time, depth, remote_time, record)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers',
+                        type=int,
+                        default=os.cpu_count(),
+                        help='Number of processes used for AI searches (int)')
+    parser.add_argument('--time',
+                        type=int,
+                        default=60,
+                        help='Time to wait for an AI move in seconds (int)')
+    parser.add_argument('--depth',
+                        type=int,
+                        default=6,
+                        help='Search depth of the AI players (int)')
+    parser.add_argument('--remote-time',
+                        type=int,
+                        default=300,
+                        help='Time to wait for a remote player\'s move in seconds (int)')
+    parser.add_argument('--record',
+                        default=None,
+                        help='Game record file to append finished games to')
+    args = parser.parse_args()
+
+    main(args.host, args.port, args.workers, args.time, args.depth, args.remote_time,
+         args.record)
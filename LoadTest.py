@@ -0,0 +1,222 @@
+# system libs
+import argparse
+import asyncio
+import math
+import random
+import time as timer
+from collections import Counter
+
+# Local libs
+from GameRecord import ROWS, COLUMNS
+
+
+def percentile(values, p):
+    # Nearest rank percentile of an already sorted list
+    if not values:
+        return float('nan')
+    rank = max(math.ceil(p / 100 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class LoadTestClient:
+    def __init__(self, games, concurrency, opponent, timeout):
+        self.games = games
+        self.concurrency = concurrency
+        self.opponent = opponent
+        self.timeout = timeout
+        self.disconnected = False
+        self.queues = {}
+        # Games given up on, whose remaining lines are ignored
+        self.abandoned = set()
+        self.pending = asyncio.Queue()
+        self.latencies = []
+        self.results = Counter()
+        self.reader = None
+        self.writer = None
+
+    async def run(self, host, port):
+        """
+        Play the games against the server, at most concurrency of them at a
+        time, standing in for the remote player with random moves
+
+        RETURNS:
+        The number of seconds it took to play every game
+        """
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        dispatcher = asyncio.create_task(self.dispatch())
+
+        start = timer.perf_counter()
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def limited(i):
+            async with slots:
+                await self.play_game(i)
+
+        try:
+            await asyncio.gather(*(limited(i) for i in range(self.games)))
+        finally:
+            elapsed = timer.perf_counter() - start
+            dispatcher.cancel()
+            try:
+                self.writer.write(b'quit\n')
+                await self.writer.drain()
+            except ConnectionError:
+                pass
+            self.writer.close()
+
+        return elapsed
+
+    async def dispatch(self):
+        # Route every server line to the game it belongs to
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                # Tell every game that is still waiting on the server
+                self.disconnected = True
+                while not self.pending.empty():
+                    created = self.pending.get_nowait()
+                    if not created.done():
+                        created.set_result(None)
+                for queue in self.queues.values():
+                    queue.put_nowait(['over', '-', '-', 'disconnected'])
+                return
+
+            args = line.decode().split()
+            if args[0] == 'game':
+                # Replies to new come back in the order the games were asked
+                # for. The queue is made here since the first moves of the
+                # game can arrive before play_game gets to run again.
+                created = self.pending.get_nowait()
+                if created.done():
+                    # The game already gave up waiting, so it isn't left
+                    # running on the server
+                    self.abandon(args[1])
+                else:
+                    self.queues[args[1]] = asyncio.Queue()
+                    created.set_result(args[1])
+            elif args[1] in self.queues:
+                self.queues[args[1]].put_nowait(args)
+            elif args[1] not in self.abandoned:
+                print(line.decode().strip())
+
+    def abandon(self, game_id):
+        self.abandoned.add(game_id)
+        self.writer.write('resign {}\n'.format(game_id).encode())
+
+    async def play_game(self, i):
+        # Alternate between moving first and second
+        remote = (i % 2) + 1
+        players = ['remote', self.opponent] if remote == 1 else [self.opponent, 'remote']
+
+        if self.disconnected:
+            self.results['disconnected'] += 1
+            return
+
+        created = asyncio.get_running_loop().create_future()
+        self.pending.put_nowait(created)
+        sent = timer.perf_counter()
+        try:
+            self.writer.write('new {} {}\n'.format(*players).encode())
+            await self.writer.drain()
+            game_id = await asyncio.wait_for(created, self.timeout)
+        except asyncio.TimeoutError:
+            self.results['timeout'] += 1
+            return
+        except ConnectionError:
+            game_id = None
+        if game_id is None:
+            self.results['disconnected'] += 1
+            return
+
+        queue = self.queues[game_id]
+        heights = [0] * COLUMNS
+        try:
+            while True:
+                # A game the server never finishes is counted, not waited on
+                try:
+                    args = await asyncio.wait_for(queue.get(), self.timeout)
+                except asyncio.TimeoutError:
+                    self.results['timeout'] += 1
+                    self.abandon(game_id)
+                    return
+                if args[0] == 'move':
+                    column = int(args[3])
+                    heights[column] += 1
+                    # Latency of a server move is measured from our last message
+                    if int(args[2]) != remote:
+                        self.latencies.append(timer.perf_counter() - sent)
+                elif args[0] == 'turn':
+                    column = random.choice([c for c in range(COLUMNS) if heights[c] < ROWS])
+                    sent = timer.perf_counter()
+                    self.writer.write('move {} {}\n'.format(game_id, column).encode())
+                    await self.writer.drain()
+                elif args[0] == 'over':
+                    result = args[2]
+                    if len(args) > 3:
+                        self.results[args[3]] += 1
+                    elif result == '0':
+                        self.results['draw'] += 1
+                    elif int(result) == remote:
+                        self.results['remote'] += 1
+                    else:
+                        self.results[self.opponent] += 1
+                    return
+                else:
+                    print(' '.join(args))
+                    self.results['error'] += 1
+                    return
+        finally:
+            del self.queues[game_id]
+
+    def report(self, elapsed):
+        latencies = sorted(l * 1000 for l in self.latencies)
+        # Only games that were won, lost or drawn count towards throughput
+        completed = sum(self.results[r] for r in ['remote', self.opponent, 'draw'])
+        print('games:     {} completed in {:.2f}s ({:.2f} games/s)'.format(
+            completed, elapsed, completed / elapsed))
+        print('failed:    {}'.format(self.games - completed))
+        print('moves:     {} server moves'.format(len(latencies)))
+        print('latency:   p50 {:.1f}ms  p90 {:.1f}ms  p99 {:.1f}ms  max {:.1f}ms'.format(
+            percentile(latencies, 50), percentile(latencies, 90),
+            percentile(latencies, 99), latencies[-1] if latencies else float('nan')))
+        print('results:   {}'.format(', '.join('{} {}'.format(k, v) for k, v in sorted(self.results.items()))))
+
+
+def main(host, port, games, concurrency, opponent, timeout):
+    """
+    Plays games against a running GameServer and reports the throughput in
+    games per second and the latency percentiles of the server moves
+
+    INPUTS:
+    games - the number of games to play
+    concurrency - the number of games played at the same time
+    opponent - a string ['ai', 'random'], the server side player
+    timeout - seconds to wait for the server before giving up on a game
+    """
+    async def run():
+        client = LoadTestClient(games, concurrency, opponent, timeout)
+        client.report(await client.run(host, port))
+
+    asyncio.run(run())
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--games',
+                        type=int,
+                        default=100,
+                        help='Number of games to play (int)')
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=16,
+                        help='Number of games played at the same time (int)')
+    parser.add_argument('--opponent', choices=['ai', 'random'], default='ai')
+    parser.add_argument('--timeout',
+                        type=int,
+                        default=120,
+                        help='Time to wait for the server before a game is counted as timed out in seconds (int)')
+    args = parser.parse_args()
+
+    main(args.host, args.port, args.games, args.concurrency, args.opponent, args.timeout)
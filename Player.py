@@ -1,6 +1,16 @@
+import time
+
 import numpy as np
 
 
+# Number of nodes searched between progress reports
+PROGRESS_INTERVAL = 25
+
+
+class SearchTimeout(Exception):
+    pass
+
+
 class AIPlayer:
     def __init__(self, player_number):
         self.player_number = player_number
@@ -12,6 +22,18 @@ class AIPlayer:
         self.beta = np.inf
         self.is_max_node = 1
         self.is_expectimax = 0
+        # Search progress: nodes searched, deepest ply reached, the root
+        # column being searched and the best column so far
+        self.nodes = 0
+        self.max_ply = 0
+        self.root_column = -1
+        self.best_column = -1
+        # Optional callable(max_ply, nodes, root_column, best_column) that is
+        # called every PROGRESS_INTERVAL nodes and after every root column
+        self.progress = None
+        # Optional time.time() by which the search has to return; it then
+        # returns the best column found so far, or None if there is none
+        self.deadline = None
 
 
     def get_alpha_beta_move(self, board):
@@ -40,6 +62,7 @@ class AIPlayer:
             highest_value = -np.inf
             highest_value_column = -1
             depth = depth + 1
+            self.count_node(depth)
 
             if depth == self.depth or len(successors_array) == 0:
                 return self.evaluation_function(state)
@@ -53,6 +76,9 @@ class AIPlayer:
                 if len(successors_array[i]) < 2:
                     continue
 
+                if depth == 1:
+                    self.root_column = i
+
                 # Grabs successor value
                 successor_value = min_value(successors_array[i], alpha, beta, depth)
 
@@ -63,6 +89,10 @@ class AIPlayer:
 
                 highest_value = max(highest_value, successor_value)
 
+                if depth == 1:
+                    self.best_column = highest_value_column
+                    self.report_progress()
+
                 if highest_value >= beta:
                     return highest_value
                 alpha = max(alpha, highest_value)
@@ -79,6 +109,7 @@ class AIPlayer:
         def min_value(state, alpha, beta, depth):
             successors_array = self.get_successors(state)
             depth = depth + 1
+            self.count_node(depth)
 
             if depth == self.depth or len(successors_array) == 0:
                 return self.evaluation_function(state)
@@ -101,7 +132,11 @@ class AIPlayer:
 
             return lowest_value
 
-        return max_value(board, self.alpha, self.beta, 0)
+        self.reset_progress()
+        try:
+            return max_value(board, self.alpha, self.beta, 0)
+        except SearchTimeout:
+            return self.best_column if self.best_column >= 0 else None
 
         # raise NotImplementedError('Whoops I don\'t know what to do')
 
@@ -142,6 +177,7 @@ class AIPlayer:
 
             v = -np.inf
             highest_value_column = -1
+            self.count_node(depth)
 
             # Checks to see if it is a leaf node or it has reached the depth limit
             if depth == self.depth or len(successors_array) == 0:
@@ -153,6 +189,9 @@ class AIPlayer:
                 if len(successors_array[i]) < 2:
                     continue
 
+                if depth == 1:
+                    self.root_column = i
+
                 # Grabs successor value
                 successor_value = get_exp_value(state, depth)
 
@@ -163,6 +202,10 @@ class AIPlayer:
 
                 v = max(v, successor_value)
 
+                if depth == 1:
+                    self.best_column = highest_value_column
+                    self.report_progress()
+
             if depth == 1:
                 return highest_value_column
 
@@ -176,6 +219,7 @@ class AIPlayer:
             successors_array = self.get_successors(state)
 
             v = 0
+            self.count_node(depth)
 
             # Checks to see if it is a leaf node or it has reached the depth limit
             if depth == self.depth or len(successors_array) == 0:
@@ -197,10 +241,32 @@ class AIPlayer:
             # If we're not at the root node (which is at depth 0), return the value of the node
             return v
 
-        return max_value(board, 0)
+        self.reset_progress()
+        try:
+            return max_value(board, 0)
+        except SearchTimeout:
+            return self.best_column if self.best_column >= 0 else None
 
         #raise NotImplementedError('Whoops I don\'t know what to do')
 
+    def reset_progress(self):
+        self.nodes = 0
+        self.max_ply = 0
+        self.root_column = -1
+        self.best_column = -1
+
+    def count_node(self, depth):
+        self.nodes = self.nodes + 1
+        self.max_ply = max(self.max_ply, depth)
+        if self.nodes % PROGRESS_INTERVAL == 0:
+            self.report_progress()
+        if self.deadline is not None and time.time() > self.deadline:
+            raise SearchTimeout()
+
+    def report_progress(self):
+        if self.progress is not None:
+            self.progress(self.max_ply, self.nodes, self.root_column, self.best_column)
+
     def evaluation_function(self, board):
         """
         Given the current stat of the board, return the scalar value that